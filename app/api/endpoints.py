@@ -1,36 +1,74 @@
-from fastapi import APIRouter, HTTPException, Depends
-from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session
-from sqlalchemy import text, func
+from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi.responses import FileResponse, StreamingResponse, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text, func, select, bindparam, JSON, DateTime, String
 from app.services.report_service import ReportService
-from app.services.data_processor import DataProcessor
+from app.services.data_processor import (
+    DataProcessor, DEFAULT_BUSINESS_HOURS, DEFAULT_TIMEZONE, max_timestamp_cache_time
+)
 from app.models.database import get_db, StoreStatus
+from datetime import datetime, timezone
+from cachetools import TTLCache
 import os
 
 router = APIRouter()
-report_service = ReportService()
+
+# debug counts scan store_status, refresh them at most once a minute
+_status_counts_cache = TTLCache(maxsize=1, ttl=60)
+
+# internal nginx location for reports/, lets nginx sendfile() the download
+REPORTS_ACCEL_REDIRECT = os.getenv("REPORTS_ACCEL_REDIRECT")
+
+# the snapshot comes from the cached max timestamp, not a max() over store_status
+_store_debug_stmt = text("""
+    SELECT
+        (SELECT timezone_str FROM store_timezones
+         WHERE store_id = :store_id LIMIT 1) AS timezone_str,
+        (SELECT json_agg(json_build_array(day_of_week, start_time_local, end_time_local)
+                         ORDER BY day_of_week)
+         FROM business_hours WHERE store_id = :store_id) AS business_hours,
+        (SELECT json_agg(json_build_array(timestamp_utc, status) ORDER BY timestamp_utc)
+         FROM store_status
+         WHERE store_id = :store_id
+           AND timestamp_utc BETWEEN :max_timestamp - interval '2 hours'
+                                 AND :max_timestamp) AS observations
+""").bindparams(bindparam("max_timestamp", type_=DateTime(timezone=True))).columns(
+    timezone_str=String, business_hours=JSON, observations=JSON
+)
+
+def get_report_service(request: Request) -> ReportService:
+    """The app-wide report service created in the lifespan"""
+    return request.app.state.report_service
 
 @router.get("/health")
 async def health_check():
     return {"status": "healthy", "service": "Loop Store Monitoring"}
 
 @router.post("/trigger_report")
-async def trigger_report():
+async def trigger_report(report_service: ReportService = Depends(get_report_service)):
     """Trigger report generation"""
-    report_id = report_service.trigger_report()
+    report_id = await report_service.trigger_report()
     return {"report_id": report_id}
 
 @router.get("/get_report")
-async def get_report(report_id: str):
+async def get_report(report_id: str, report_service: ReportService = Depends(get_report_service)):
     """Get report status or download completed report"""
-    status = report_service.get_report_status(report_id)
+    status = await report_service.get_report_status(report_id)
     
-    if "error" in status:
-        raise HTTPException(status_code=404, detail=status["error"])
+    if status["status"] == "Not Found":
+        raise HTTPException(status_code=404, detail="Report not found")
     
     if status["status"] == "Complete":
         filepath = os.path.join("reports", status["filename"])
         if os.path.exists(filepath):
+            if REPORTS_ACCEL_REDIRECT:
+                return Response(
+                    media_type="text/csv",
+                    headers={
+                        "X-Accel-Redirect": f"{REPORTS_ACCEL_REDIRECT.rstrip('/')}/{status['filename']}",
+                        "Content-Disposition": f'attachment; filename="{status["filename"]}"'
+                    }
+                )
             return FileResponse(
                 filepath, 
                 media_type="text/csv",
@@ -41,36 +79,65 @@ async def get_report(report_id: str):
     
     return status
 
+@router.get("/get_report/stream")
+async def stream_report(report_id: str, report_service: ReportService = Depends(get_report_service)):
+    """Stream report CSV rows as each store's metrics are computed"""
+    status = await report_service.get_report_status(report_id)
+    
+    if status["status"] == "Not Found":
+        raise HTTPException(status_code=404, detail="Report not found")
+    
+    return StreamingResponse(
+        report_service.iter_rows(report_id),
+        media_type="text/csv",
+        headers={"Content-Disposition": f"attachment; filename=report_{report_id}.csv"}
+    )
+
 # Debug endpoints
 @router.get("/debug/max_timestamp")
-async def get_max_timestamp(db: Session = Depends(get_db)):
+async def get_max_timestamp(db: AsyncSession = Depends(get_db)):
     """Get the dynamic maximum timestamp from data"""
-    processor = DataProcessor(db)
-    max_timestamp = processor.get_max_timestamp()
+    max_timestamp = await db.run_sync(lambda session: DataProcessor(session).get_max_timestamp())
+    cache_time = max_timestamp_cache_time()
     
     return {
         "max_timestamp": max_timestamp.isoformat(),
         "max_timestamp_utc": max_timestamp,
-        "cache_time": processor._cache_time.isoformat() if processor._cache_time else None
+        "cache_time": cache_time.isoformat() if cache_time else None
     }
 
 @router.get("/debug/status_counts")
-async def get_status_counts(db: Session = Depends(get_db)):
-    """Get count of active/inactive statuses"""
-    active_count = db.query(StoreStatus).filter(StoreStatus.status == 'active').count()
-    inactive_count = db.query(StoreStatus).filter(StoreStatus.status == 'inactive').count()
-    total_count = db.query(StoreStatus).count()
+async def get_status_counts(db: AsyncSession = Depends(get_db)):
+    """Get count of active/inactive statuses, cached for 60s"""
+    counts = _status_counts_cache.get("status_counts")
+    if counts is not None:
+        return counts
     
-    return {
-        "active_count": active_count,
-        "inactive_count": inactive_count,
-        "total_count": total_count
+    result = await db.execute(
+        select(StoreStatus.status, func.count()).group_by(StoreStatus.status)
+    )
+    by_status = dict(result.all())
+    
+    # planner estimate for the total, -1 until the table has been analyzed
+    total_count = await db.scalar(text(
+        "SELECT reltuples::bigint FROM pg_class WHERE relname = 'store_status'"
+    ))
+    if total_count is None or total_count < 0:
+        total_count = sum(by_status.values())
+    
+    counts = {
+        "active_count": by_status.get('active', 0),
+        "inactive_count": by_status.get('inactive', 0),
+        "total_count": total_count,
+        "refreshed_at": datetime.now(timezone.utc).isoformat()
     }
+    _status_counts_cache["status_counts"] = counts
+    return counts
 
 @router.get("/debug/stores_with_downtime")
-async def get_stores_with_downtime(db: Session = Depends(get_db)):
+async def get_stores_with_downtime(db: AsyncSession = Depends(get_db)):
     """Get stores that have inactive status (potential downtime)"""
-    result = db.execute(text("""
+    result = await db.execute(text("""
         SELECT store_id, COUNT(*) as inactive_count 
         FROM store_status 
         WHERE status = 'inactive' 
@@ -83,19 +150,23 @@ async def get_stores_with_downtime(db: Session = Depends(get_db)):
     return {"stores_with_downtime": stores}
 
 @router.get("/debug/store/{store_id}")
-async def get_store_debug_info(store_id: str, db: Session = Depends(get_db)):
+async def get_store_debug_info(store_id: str, db: AsyncSession = Depends(get_db)):
     """Get debug info for a specific store"""
-    processor = DataProcessor(db)
-    max_timestamp = processor.get_max_timestamp()
-    
-    # Get recent observations
-    from datetime import timedelta
-    recent_start = max_timestamp - timedelta(hours=2)
-    observations = processor.get_store_observations(store_id, recent_start, max_timestamp)
+    # same cached snapshot reports use, then one round trip for timezone, hours
+    # and the last 2h of observations
+    max_timestamp = await db.run_sync(lambda session: DataProcessor(session).get_max_timestamp())
+    row = (await db.execute(
+        _store_debug_stmt, {"store_id": store_id, "max_timestamp": max_timestamp}
+    )).one()
     
-    # Get store config
-    timezone_str = processor.get_store_timezone(store_id)
-    business_hours = processor.get_business_hours(store_id)
+    timezone_str = row.timezone_str or DEFAULT_TIMEZONE
+    business_hours = {
+        day: (start, end) for day, start, end in (row.business_hours or [])
+    } or DEFAULT_BUSINESS_HOURS
+    observations = [
+        (datetime.fromisoformat(ts).astimezone(timezone.utc), status)
+        for ts, status in (row.observations or [])
+    ]
     
     return {
         "store_id": store_id,
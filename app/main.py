@@ -1,14 +1,35 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from app.api.endpoints import router
 from app.models.database import engine, Base
+from app.services.report_service import ReportService
+import os
 import uvicorn
 
 Base.metadata.create_all(bind=engine)
 
+# uvicorn workers x concurrent reports x metric processes per report stays within the cores
+WORKERS = max(2, (os.cpu_count() or 1) // 2)
+MAX_CONCURRENT_REPORTS = 2
+METRIC_WORKERS = max(1, (os.cpu_count() or 1) // (WORKERS * MAX_CONCURRENT_REPORTS))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # one report service per process, sharing the pooled engine
+    app.state.report_service = ReportService(
+        engine=engine,
+        max_concurrent_reports=MAX_CONCURRENT_REPORTS,
+        metric_workers=METRIC_WORKERS
+    )
+    await app.state.report_service.fail_stale_reports()
+    yield
+    app.state.report_service.close()
+
 app = FastAPI(
     title="Store Monitoring API",
     description="API for store uptime reports",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 app.include_router(router, prefix="/api/v1")
@@ -22,4 +43,11 @@ async def health_check():
     return {"status": "ok"}
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(
+        "app.main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=WORKERS
+    )
\ No newline at end of file
@@ -1,10 +1,10 @@
-from sqlalchemy import create_engine, Column, String, DateTime, Integer, Time, Boolean
+from sqlalchemy import create_engine, Column, String, DateTime, Integer, Time, Boolean, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.dialects.postgresql import UUID
 import uuid
 import os
-import pytz
 from dotenv import load_dotenv
 from contextlib import asynccontextmanager
 
@@ -12,23 +12,38 @@ load_dotenv()
 
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+# sync engine for schema setup and background report generation
+engine = create_engine(SQLALCHEMY_DATABASE_URL, query_cache_size=1200)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# async engine for request handlers, keeps queries off the event loop thread
+async_engine = create_async_engine(
+    SQLALCHEMY_DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1),
+    query_cache_size=1200,
+    connect_args={"prepared_statement_cache_size": 500}
+)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 class StoreStatus(Base):
     __tablename__ = "store_status"
+    # serves store_id equality + timestamp range + order in one index walk,
+    # status is carried in the leaf so observation reads are index-only
+    __table_args__ = (
+        Index("ix_store_status_sid_ts", "store_id", "timestamp_utc", postgresql_include=["status"]),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    store_id = Column(String, index=True)
+    store_id = Column(String)
     timestamp_utc = Column(DateTime(timezone=True))  # Make timezone-aware
     status = Column(String)  # 'active' or 'inactive'
 
 class BusinessHours(Base):
     __tablename__ = "business_hours"
+    __table_args__ = (Index("ix_bh_sid_dow", "store_id", "day_of_week"),)
     
     id = Column(Integer, primary_key=True, index=True)
-    store_id = Column(String, index=True)
+    store_id = Column(String)
     day_of_week = Column(Integer)  # 0=Monday, 6=Sunday
     start_time_local = Column(Time)
     end_time_local = Column(Time)
@@ -42,25 +57,22 @@ class StoreTimezone(Base):
 
 class ReportStatus(Base):
     __tablename__ = "report_status"
+    # finds the report already built for a data snapshot
+    __table_args__ = (Index("ix_report_status_max_ts", "max_timestamp"),)
     
     report_id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     status = Column(String, default="Running")  # 'Running', 'Complete', 'Failed'
     created_at = Column(DateTime(timezone=True))  # Make timezone-aware
     completed_at = Column(DateTime(timezone=True), nullable=True)  # Make timezone-aware
     file_path = Column(String, nullable=True)
+    max_timestamp = Column(DateTime(timezone=True), nullable=True)  # data snapshot the report is built for
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 @asynccontextmanager
 async def get_db_session():
     """Async context manager for database sessions"""
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
\ No newline at end of file
+    async with AsyncSessionLocal() as db:
+        yield db
\ No newline at end of file
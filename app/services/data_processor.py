@@ -1,263 +1,545 @@
-from datetime import datetime, timedelta, time
+from datetime import datetime, timedelta, time, timezone
+from zoneinfo import ZoneInfo
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from multiprocessing import shared_memory
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import func, text, select, bindparam
 from app.models.database import StoreStatus, BusinessHours, StoreTimezone
-from typing import Dict, List, Tuple
-import pytz
+from typing import Dict, Iterator, List, Optional, Tuple
+from numba import njit
+from cachetools import TTLCache
+import numpy as np
+import pandas as pd
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+NS_PER_MINUTE = 60 * 10**9
+NS_PER_HOUR = 60 * NS_PER_MINUTE
+NS_PER_DAY = 24 * NS_PER_HOUR
+
+# below this many stores the process pool costs more than it saves
+PARALLEL_MIN_STORES = 500
+
+# rows fetched per server-side cursor round trip of the weekly scan
+OBSERVATION_CHUNK_ROWS = 200_000
+
+# stores without a timezone are taken to be in Chicago
+DEFAULT_TIMEZONE = "America/Chicago"
+
+# stores without business hours are open 24/7, one shared read-only dict
+DEFAULT_BUSINESS_HOURS = {i: (time(0, 0), time(23, 59, 59)) for i in range(7)}
+
+# statements built once so their compiled form is reused from the engine cache
+_max_timestamp_stmt = select(func.max(StoreStatus.timestamp_utc))
+
+_timezone_stmt = select(StoreTimezone.timezone_str).where(
+    StoreTimezone.store_id == bindparam("store_id")
+).limit(1)
+
+_business_hours_stmt = select(
+    BusinessHours.day_of_week, BusinessHours.start_time_local, BusinessHours.end_time_local
+).where(BusinessHours.store_id == bindparam("store_id"))
+
+_observations_stmt = select(StoreStatus.timestamp_utc, StoreStatus.status).where(
+    StoreStatus.store_id == bindparam("store_id"),
+    StoreStatus.timestamp_utc.between(bindparam("start_time"), bindparam("end_time"))
+).order_by(StoreStatus.timestamp_utc)
+
+# distinct store ids by skipping through the (store_id, timestamp_utc) index
+# one store at a time, instead of reading every row
+_store_ids_stmt = text("""
+    WITH RECURSIVE store_ids AS (
+        (SELECT store_id FROM store_status ORDER BY store_id LIMIT 1)
+        UNION ALL
+        SELECT (
+            SELECT store_id FROM store_status
+            WHERE store_id > store_ids.store_id
+            ORDER BY store_id LIMIT 1
+        )
+        FROM store_ids
+        WHERE store_ids.store_id IS NOT NULL
+    )
+    SELECT store_id FROM store_ids WHERE store_id IS NOT NULL
+""")
+
+_week_observations_stmt = select(
+    StoreStatus.store_id, StoreStatus.timestamp_utc, StoreStatus.status
+).where(
+    StoreStatus.timestamp_utc.between(bindparam("week_start"), bindparam("max_timestamp"))
+).order_by(StoreStatus.store_id, StoreStatus.timestamp_utc)
+
+def _to_ns(dt: datetime) -> int:
+    """aware datetime -> int64 nanoseconds since epoch (UTC)"""
+    # the one place datetimes become int64, a naive one here would be silently read as UTC
+    if dt.tzinfo is None:
+        raise ValueError(f"naive datetime {dt} has no timezone, expected UTC-aware")
+    return pd.Timestamp(dt).value
+
+def _observation_arrays(frame: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """timestamp_utc/status columns -> int64 ns UTC timestamps + int8 active flags, column-wise"""
+    timestamps = pd.to_datetime(frame["timestamp_utc"], utc=True).dt.tz_convert(None)
+    ts_ns = timestamps.to_numpy(dtype="datetime64[ns]").view("i8")
+    active = (frame["status"] == 'active').to_numpy(dtype=np.int8)
+    return ts_ns, active
+
+@lru_cache(maxsize=512)
+def _get_tz(timezone_str: str) -> ZoneInfo:
+    """zone by name, kept alive so it isn't re-read from tzdata for every store"""
+    return ZoneInfo(timezone_str)
+
+def _merge_intervals(bounds: np.ndarray) -> np.ndarray:
+    """coalesce overlapping or touching (n, 2) intervals so no time is counted twice"""
+    if len(bounds) < 2:
+        return bounds
+    
+    bounds = bounds[np.argsort(bounds[:, 0], kind="stable")]
+    
+    # an interval opens a new group when it starts after everything before it has ended
+    reach = np.maximum.accumulate(bounds[:, 1])
+    group_starts = np.flatnonzero(np.r_[True, bounds[1:, 0] > reach[:-1]])
+    return np.column_stack((
+        bounds[group_starts, 0],
+        np.maximum.reduceat(bounds[:, 1], group_starts)
+    ))
+
+def _time_of_day_ns(local_time: time) -> int:
+    """nanoseconds since local midnight"""
+    seconds = local_time.hour * 3600 + local_time.minute * 60 + local_time.second
+    return seconds * 10**9 + local_time.microsecond * 1000
+
+@njit(cache=True)
+def _add_overlap(totals, window_starts, start, end):
+    """add the part of [start, end) inside each window to that window's total"""
+    for w in range(window_starts.size):
+        lo = max(start, window_starts[w])
+        if end > lo:
+            totals[w] += end - lo
+
+@njit(cache=True)
+def _interp(ts_ns, active, period_starts, period_ends, window_starts):
+    """uptime and business-hours ns per window, all windows in one pass over sorted observations"""
+    n = ts_ns.size
+    uptime = np.zeros(window_starts.size, dtype=np.int64)
+    duration = np.zeros(window_starts.size, dtype=np.int64)
+    
+    for k in range(period_starts.size):
+        period_start = period_starts[k]
+        period_end = period_ends[k]
+        _add_overlap(duration, window_starts, period_start, period_end)
+        i = np.searchsorted(ts_ns, period_start)
+        
+        # status at period start: last observation before it, else first inside, else active
+        if i > 0:
+            status = active[i - 1] != 0
+        elif n > 0 and ts_ns[0] <= period_end:
+            status = active[0] != 0
+        else:
+            status = True
+        
+        # each status holds until the next observation or the period end
+        prev = period_start
+        while i < n and ts_ns[i] <= period_end:
+            if status:
+                _add_overlap(uptime, window_starts, prev, ts_ns[i])
+            prev = ts_ns[i]
+            status = active[i] != 0
+            i += 1
+        if status:
+            _add_overlap(uptime, window_starts, prev, period_end)
+    
+    return uptime, duration
+
+# latest store_status timestamp and when it was read, shared by every DataProcessor in the process
+_max_timestamp_cache = TTLCache(maxsize=1, ttl=300)
+_max_timestamp_lock = threading.Lock()
+
+# the set of stores changes slowly, re-read it at most every 10 mins
+_store_ids_cache = TTLCache(maxsize=1, ttl=600)
+_store_ids_lock = threading.Lock()
+
+def max_timestamp_cache_time() -> Optional[datetime]:
+    """when the cached max timestamp was read, None if nothing is cached"""
+    cached = _max_timestamp_cache.get("max_timestamp")
+    return cached[1] if cached else None
+
+# per-process state of the parallel metrics workers
+_worker = {}
+
+def _init_metrics_worker(tz_map: dict, bh_map: dict, max_timestamp: datetime):
+    """store config shared by every chunk, sent once per worker process"""
+    processor = DataProcessor(None)
+    processor._tz_map = tz_map
+    processor._bh_map = bh_map
+    _worker.update(processor=processor, max_timestamp=max_timestamp)
+
+def _attach_segment(segment: Tuple[str, str, int]):
+    """map a chunk's shared observation arrays, releasing the previous chunk's"""
+    if _worker.get("segment") == segment:
+        return
+    
+    # views must go before the buffers they point into can be closed
+    _worker.pop("ts_ns", None)
+    _worker.pop("active", None)
+    for shm in _worker.pop("shm", ()):
+        shm.close()
+    
+    ts_name, active_name, size = segment
+    ts_shm = shared_memory.SharedMemory(name=ts_name)
+    active_shm = shared_memory.SharedMemory(name=active_name)
+    _worker.update(
+        segment=segment,
+        shm=(ts_shm, active_shm),
+        ts_ns=np.ndarray((size,), dtype=np.int64, buffer=ts_shm.buf),
+        active=np.ndarray((size,), dtype=np.int8, buffer=active_shm.buf)
+    )
+
+def _compute_row(task: Tuple[Tuple[str, str, int], str, int, int]) -> dict:
+    """metrics for one store, reading its slice of the shared arrays"""
+    segment, store_id, lo, hi = task
+    _attach_segment(segment)
+    return _worker["processor"]._safe_metrics(
+        store_id, _worker["ts_ns"][lo:hi], _worker["active"][lo:hi], _worker["max_timestamp"]
+    )
 
 class DataProcessor:
     def __init__(self, db: Session):
         self.db = db
-        self._max_timestamp_cache = None
-        self._cache_time = None
-        self._cache_duration = timedelta(minutes=5)  # cache for 5 mins
+        self._tz_map: Optional[Dict[str, str]] = None
+        self._bh_map: Optional[Dict[str, Dict[int, Tuple[time, time]]]] = None
+        # week business periods by (snapshot, timezone, schedule), shared by stores alike in both
+        self._overlap_cache: Dict[tuple, np.ndarray] = {}
+    
+    def preload(self):
+        """load all store timezones and business hours into memory"""
+        self._tz_map = dict(
+            self.db.execute(select(StoreTimezone.store_id, StoreTimezone.timezone_str)).all()
+        )
+        
+        bh_map = {}
+        rows = self.db.execute(select(
+            BusinessHours.store_id, BusinessHours.day_of_week,
+            BusinessHours.start_time_local, BusinessHours.end_time_local
+        ))
+        for store_id, day_of_week, start_time_local, end_time_local in rows:
+            bh_map.setdefault(store_id, {})[day_of_week] = (start_time_local, end_time_local)
+        
+        # stores of a chain mostly share a schedule, keep one dict per distinct schedule
+        schedules = {}
+        self._bh_map = {
+            store_id: schedules.setdefault(tuple(sorted(hours.items())), hours)
+            for store_id, hours in bh_map.items()
+        }
+    
+    def for_session(self, db: Session) -> "DataProcessor":
+        """processor on another session sharing this one's preloaded store config"""
+        processor = DataProcessor(db)
+        processor._tz_map = self._tz_map
+        processor._bh_map = self._bh_map
+        processor._overlap_cache = self._overlap_cache
+        return processor
+    
+    def get_store_ids(self) -> List[str]:
+        """every store with status observations, cached process-wide for 10 mins"""
+        # as with the max timestamp, the lock never spans the query
+        with _store_ids_lock:
+            store_ids = _store_ids_cache.get("store_ids")
+        if store_ids is None:
+            store_ids = self.db.execute(_store_ids_stmt).scalars().all()
+            with _store_ids_lock:
+                _store_ids_cache["store_ids"] = store_ids
+        
+        # callers get their own list, the cached one stays intact
+        return list(store_ids)
     
     def get_max_timestamp(self) -> datetime:
-        """the latest timestamp from store_status"""
-        # check cache for result
-        if (self._max_timestamp_cache and self._cache_time and 
-            datetime.utcnow() - self._cache_time < self._cache_duration):
-            return self._max_timestamp_cache
+        """the latest timestamp from store_status, cached process-wide for 5 mins"""
+        # the lock covers only the cache itself, never the query: under AsyncSession.run_sync
+        # the query suspends a greenlet on the loop thread, and a second caller blocking on
+        # the lock there would deadlock the loop; concurrent misses just query twice
+        with _max_timestamp_lock:
+            cached = _max_timestamp_cache.get("max_timestamp")
+        if cached:
+            return cached[0]
         
         # query for max timestamp
-        max_timestamp = self.db.query(func.max(StoreStatus.timestamp_utc)).scalar()
+        max_timestamp = self.db.execute(_max_timestamp_stmt).scalar()
         
         if max_timestamp:
-            # make sure it's timezone aware
-            if max_timestamp.tzinfo is None:
-                max_timestamp = max_timestamp.replace(tzinfo=pytz.UTC)
-            
-            # cache it
-            self._max_timestamp_cache = max_timestamp
-            self._cache_time = datetime.utcnow()
-            
+            with _max_timestamp_lock:
+                _max_timestamp_cache["max_timestamp"] = (max_timestamp, datetime.now(timezone.utc))
             return max_timestamp
-        else:
-            # fallback if no data
-            return datetime.now(pytz.UTC)
+        
+        # fallback if no data, not cached so new data shows up immediately
+        return datetime.now(timezone.utc)
     
     def get_store_timezone(self, store_id: str) -> str:
         """timezone for store, default to America/Chicago """
-        timezone_record = self.db.query(StoreTimezone).filter(
-            StoreTimezone.store_id == store_id
-        ).first()
-        return timezone_record.timezone_str if timezone_record else "America/Chicago"
+        if self._tz_map is not None:
+            return self._tz_map.get(store_id, DEFAULT_TIMEZONE)
+        
+        timezone_str = self.db.execute(_timezone_stmt, {"store_id": store_id}).scalar()
+        return timezone_str if timezone_str else DEFAULT_TIMEZONE
     
     def get_business_hours(self, store_id: str) -> Dict[int, Tuple[time, time]]:
         """business hours for store, 24/7 if not found"""
-        hours = self.db.query(BusinessHours).filter(
-            BusinessHours.store_id == store_id
-        ).all()
-        
-        if not hours:
-            # default to 24/7
-            return {i: (time(0, 0), time(23, 59, 59)) for i in range(7)}
+        if self._bh_map is not None:
+            business_hours = self._bh_map.get(store_id)
+        else:
+            business_hours = {}
+            hours = self.db.execute(_business_hours_stmt, {"store_id": store_id}).all()
+            for day_of_week, start_time_local, end_time_local in hours:
+                business_hours[day_of_week] = (start_time_local, end_time_local)
         
-        business_hours = {}
-        for hour in hours:
-            business_hours[hour.day_of_week] = (hour.start_time_local, hour.end_time_local)
+        if not business_hours:
+            return DEFAULT_BUSINESS_HOURS
         
         return business_hours
     
-    def get_store_observations(self, store_id: str, start_time: datetime, end_time: datetime) -> List[Tuple[datetime, str]]:
-        """store status observations within time range"""
-        # make sure times are timezone-aware
-        if start_time.tzinfo is None:
-            start_time = start_time.replace(tzinfo=pytz.UTC)
-        if end_time.tzinfo is None:
-            end_time = end_time.replace(tzinfo=pytz.UTC)
-            
-        observations = self.db.query(StoreStatus).filter(
-            StoreStatus.store_id == store_id,
-            StoreStatus.timestamp_utc >= start_time,
-            StoreStatus.timestamp_utc <= end_time
-        ).order_by(StoreStatus.timestamp_utc).all()
-        
-        # make sure all returned timestamps are timezone-aware
-        result = []
-        for obs in observations:
-            obs_time = obs.timestamp_utc
-            if obs_time.tzinfo is None:
-                obs_time = obs_time.replace(tzinfo=pytz.UTC)
-            result.append((obs_time, obs.status))
+    def get_store_observation_arrays(self, store_id: str, start_time: datetime,
+                                     end_time: datetime) -> Tuple[np.ndarray, np.ndarray]:
+        """store observations within time range as sorted int64 ns timestamps + active flags"""
+        rows = self.db.execute(
+            _observations_stmt,
+            {"store_id": store_id, "start_time": start_time, "end_time": end_time}
+        ).all()
         
-        return result
+        return _observation_arrays(pd.DataFrame(rows, columns=["timestamp_utc", "status"]))
     
     def calculate_business_hours_overlap(self, start_time: datetime, end_time: datetime, 
                                        business_hours: Dict[int, Tuple[time, time]], 
-                                       timezone_str: str) -> List[Tuple[datetime, datetime]]:
-        """overlap between time range and business hours"""
-        # ensure input times are timezone-aware
-        if start_time.tzinfo is None:
-            start_time = pytz.UTC.localize(start_time)
-        if end_time.tzinfo is None:
-            end_time = pytz.UTC.localize(end_time)
-            
-        tz = pytz.timezone(timezone_str)
-        overlaps = []
+                                       timezone_str: str) -> np.ndarray:
+        """overlap between time range and business hours as (n, 2) UTC nanosecond intervals"""
+        tz = _get_tz(timezone_str)
         
-        current = start_time
-        while current < end_time:
-            local_time = current.astimezone(tz)
-            day_of_week = local_time.weekday()
-            
-            if day_of_week in business_hours:
-                start_bh, end_bh = business_hours[day_of_week]
-                
-                # convert business hours to datetime for this day
-                day_start = local_time.replace(hour=start_bh.hour, minute=start_bh.minute, 
-                                             second=start_bh.second, microsecond=0)
-                day_end = local_time.replace(hour=end_bh.hour, minute=end_bh.minute, 
-                                           second=end_bh.second, microsecond=0)
-                
-                # handle overnight business hours
-                if end_bh < start_bh:
-                    day_end += timedelta(days=1)
-                
-                # convert back to UTC 
-                day_start_utc = day_start.astimezone(pytz.UTC)
-                day_end_utc = day_end.astimezone(pytz.UTC)
-                
-                # calculate overlap
-                overlap_start = max(current, day_start_utc)
-                overlap_end = min(end_time, day_end_utc)
-                
-                if overlap_start < overlap_end:
-                    overlaps.append((overlap_start, overlap_end))
-            
-            current += timedelta(days=1)
-            current = current.replace(hour=0, minute=0, second=0, microsecond=0)
-            if current.tzinfo is None:
-                current = pytz.UTC.localize(current)
+        # business hours as offsets from local midnight, indexed by weekday (-1 = closed)
+        start_offsets = np.full(7, -1, dtype=np.int64)
+        end_offsets = np.full(7, -1, dtype=np.int64)
+        for day_of_week, (start_bh, end_bh) in business_hours.items():
+            start_offsets[day_of_week] = _time_of_day_ns(start_bh)
+            end_offsets[day_of_week] = _time_of_day_ns(end_bh)
+            # handle overnight business hours
+            if end_bh < start_bh:
+                end_offsets[day_of_week] += NS_PER_DAY
+        
+        # local calendar days, starting a day early for overnight hours
+        days = pd.date_range(
+            start_time.astimezone(tz).date() - timedelta(days=1),
+            end_time.astimezone(tz).date(),
+            freq="D"
+        )
+        day_of_week = days.weekday.to_numpy()
+        is_open = start_offsets[day_of_week] >= 0
+        days = days[is_open]
+        day_of_week = day_of_week[is_open]
+        
+        # localize every opening/closing time at once; ambiguous times resolve to
+        # standard time, and times skipped by a DST jump move past the gap
+        not_dst = np.zeros(len(days), dtype=bool)
+        local_starts = days + pd.to_timedelta(start_offsets[day_of_week])
+        local_ends = days + pd.to_timedelta(end_offsets[day_of_week])
+        bounds = np.column_stack((
+            local_starts.tz_localize(tz, ambiguous=not_dst, nonexistent="shift_forward").as_unit("ns").asi8,
+            local_ends.tz_localize(tz, ambiguous=not_dst, nonexistent="shift_forward").as_unit("ns").asi8
+        ))
+        
+        # clip every day to the requested range and drop the empty ones
+        bounds[:, 0] = np.maximum(bounds[:, 0], _to_ns(start_time))
+        bounds[:, 1] = np.minimum(bounds[:, 1], _to_ns(end_time))
+        bounds = bounds[bounds[:, 0] < bounds[:, 1]]
         
-        return overlaps
+        return _merge_intervals(bounds)
     
-    def interpolate_status(self, observations: List[Tuple[datetime, str]], 
-                          business_periods: List[Tuple[datetime, datetime]]) -> Tuple[float, float]:
-        """interpolate uptime/downtime for business periods"""
-        total_uptime = 0.0
-        total_downtime = 0.0
+    def interpolate_windows(self, ts_ns: np.ndarray, active: np.ndarray, business_periods: np.ndarray,
+                            window_starts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """uptime/downtime minutes of the business periods from each window start on"""
+        period_starts = np.ascontiguousarray(business_periods[:, 0])
+        period_ends = np.ascontiguousarray(business_periods[:, 1])
         
-        for period_start, period_end in business_periods:
-            # Ensure period times are timezone-aware
-            if period_start.tzinfo is None:
-                period_start = pytz.UTC.localize(period_start)
-            if period_end.tzinfo is None:
-                period_end = pytz.UTC.localize(period_end)
-                
-            period_duration = (period_end - period_start).total_seconds() / 60  # minutes
-            
-            # get observations within this period
-            period_observations = []
-            for ts, status in observations:
-                if ts.tzinfo is None:
-                    ts = pytz.UTC.localize(ts)
-                if period_start <= ts <= period_end:
-                    period_observations.append((ts, status))
-            
-            if not period_observations:
-                # no observations, assume last known status or active if none
-                if observations:
-                    # find the closest observation before this period
-                    closest_obs = None
-                    for ts, status in reversed(observations):
-                        if ts.tzinfo is None:
-                            ts = pytz.UTC.localize(ts)
-                        if ts < period_start:
-                            closest_obs = status
-                            break
-                    
-                    if closest_obs == 'active':
-                        total_uptime += period_duration
-                    else:
-                        total_downtime += period_duration
-                else:
-                    # no observations at all, assume active
-                    total_uptime += period_duration
-            else:
-                # interpolate based on observations
-                period_uptime, period_downtime = self._interpolate_period(
-                    period_observations, period_start, period_end
-                )
-                total_uptime += period_uptime
-                total_downtime += period_downtime
+        # overlap and interpolation fused into one compiled pass, no per-period Python work
+        uptime, duration = _interp(ts_ns, active, period_starts, period_ends, window_starts)
         
-        return total_uptime, total_downtime
+        return uptime / NS_PER_MINUTE, (duration - uptime) / NS_PER_MINUTE
     
-    def _interpolate_period(self, observations: List[Tuple[datetime, str]], 
-                           period_start: datetime, period_end: datetime) -> Tuple[float, float]:
-        """interpolate uptime/downtime for a single business period"""
-        if not observations:
-            return 0.0, 0.0
+    def calculate_store_metrics(self, store_id: str, max_timestamp: Optional[datetime] = None) -> dict:
+        """metrics for a store, as of max_timestamp (latest data if not given)"""
+        if max_timestamp is None:
+            max_timestamp = self.get_max_timestamp()
+        last_week_start = max_timestamp - timedelta(days=7)
         
-        # ensure all times are timezone-aware
-        if period_start.tzinfo is None:
-            period_start = pytz.UTC.localize(period_start)
-        if period_end.tzinfo is None:
-            period_end = pytz.UTC.localize(period_end)
+        # the week window covers hour and day, so one query is enough
+        ts_ns, active = self.get_store_observation_arrays(store_id, last_week_start, max_timestamp)
         
-        total_uptime = 0.0
-        current_time = period_start
-        current_status = observations[0][1]
+        return self._metrics_from_arrays(store_id, ts_ns, active, max_timestamp)
+    
+    def iter_store_metrics_bulk(self, store_ids: Optional[List[str]] = None,
+                                max_timestamp: Optional[datetime] = None,
+                                max_workers: int = 1) -> Iterator[List[dict]]:
+        """store metrics in batches, one per observation chunk, so callers can write as they go;
+        with max_workers > 1 big chunks are spread over that many processes"""
+        self.preload()
+        if max_timestamp is None:
+            max_timestamp = self.get_max_timestamp()
+        last_week_start = max_timestamp - timedelta(days=7)
         
-        for obs_time, obs_status in observations:
-            if obs_time.tzinfo is None:
-                obs_time = pytz.UTC.localize(obs_time)
+        # stores still owed a row; each store's rows arrive in exactly one chunk
+        pending = set(store_ids) if store_ids is not None else None
+        executor = None
+        try:
+            chunks = self._iter_observation_chunks(last_week_start, max_timestamp)
+            for store_col, ts_ns, active in chunks:
+                tasks = [
+                    task for task in self._store_slices(store_col)
+                    if pending is None or task[0] in pending
+                ]
                 
-            # add time for current status
-            duration = (obs_time - current_time).total_seconds() / 60
-            if current_status == 'active':
-                total_uptime += duration
-            
-            current_time = obs_time
-            current_status = obs_status
+                # the pool is started once, on the first chunk big enough to need it
+                if executor is None and max_workers > 1 and len(tasks) >= PARALLEL_MIN_STORES:
+                    executor = ProcessPoolExecutor(
+                        max_workers=max_workers,
+                        initializer=_init_metrics_worker,
+                        initargs=(self._tz_map, self._bh_map, max_timestamp)
+                    )
+                
+                if executor is not None:
+                    rows = self._compute_rows_parallel(executor, tasks, ts_ns, active)
+                else:
+                    rows = [
+                        self._safe_metrics(store_id, ts_ns[lo:hi], active[lo:hi], max_timestamp)
+                        for store_id, lo, hi in tasks
+                    ]
+                
+                if pending is not None:
+                    pending.difference_update(store_id for store_id, _, _ in tasks)
+                if rows:
+                    yield rows
+        finally:
+            if executor is not None:
+                executor.shutdown()
         
-        # handle remaining time until period end
-        remaining_duration = (period_end - current_time).total_seconds() / 60
-        if current_status == 'active':
-            total_uptime += remaining_duration
+        # stores without observations this week still get a row
+        if pending:
+            no_ts = np.empty(0, dtype=np.int64)
+            no_active = np.empty(0, dtype=np.int8)
+            yield [
+                self._safe_metrics(store_id, no_ts, no_active, max_timestamp)
+                for store_id in store_ids if store_id in pending
+            ]
+    
+    def _iter_observation_chunks(self, week_start: datetime, max_timestamp: datetime):
+        """(store ids, ts_ns, active) arrays streamed off a server-side cursor, whole stores only"""
+        result = self.db.execute(
+            _week_observations_stmt,
+            {"week_start": week_start, "max_timestamp": max_timestamp},
+            execution_options={"stream_results": True, "yield_per": OBSERVATION_CHUNK_ROWS}
+        )
         
-        period_duration = (period_end - period_start).total_seconds() / 60
-        total_downtime = period_duration - total_uptime
+        carry = None
+        for rows in result.partitions():
+            frame = pd.DataFrame(rows, columns=["store_id", "timestamp_utc", "status"])
+            chunk = (frame["store_id"].to_numpy(), *_observation_arrays(frame))
+            if carry is not None:
+                chunk = tuple(np.concatenate(pair) for pair in zip(carry, chunk))
+            
+            # the last store may continue in the next partition, hold it back
+            store_col = chunk[0]
+            other = np.flatnonzero(store_col != store_col[-1])
+            split = other[-1] + 1 if len(other) else 0
+            carry = tuple(array[split:] for array in chunk)
+            if split:
+                yield tuple(array[:split] for array in chunk)
         
-        return total_uptime, total_downtime
+        if carry is not None:
+            yield carry
+    
+    @staticmethod
+    def _store_slices(store_col: np.ndarray) -> List[Tuple[str, int, int]]:
+        """rows are ordered by store, so each store is one contiguous [lo, hi) slice"""
+        starts = np.flatnonzero(np.r_[True, store_col[1:] != store_col[:-1]])
+        ends = np.r_[starts[1:], len(store_col)]
+        return [(store_col[lo], int(lo), int(hi)) for lo, hi in zip(starts, ends)]
+    
+    def _compute_rows_parallel(self, executor: ProcessPoolExecutor, tasks: List[Tuple[str, int, int]],
+                               ts_ns: np.ndarray, active: np.ndarray) -> List[dict]:
+        """fan a chunk's stores out over the pool, observations shared instead of copied per child"""
+        ts_shm = shared_memory.SharedMemory(create=True, size=ts_ns.nbytes)
+        active_shm = shared_memory.SharedMemory(create=True, size=active.nbytes)
+        try:
+            np.ndarray(ts_ns.shape, dtype=np.int64, buffer=ts_shm.buf)[:] = ts_ns
+            np.ndarray(active.shape, dtype=np.int8, buffer=active_shm.buf)[:] = active
+            
+            segment = (ts_shm.name, active_shm.name, len(ts_ns))
+            return list(executor.map(
+                _compute_row, [(segment, *task) for task in tasks], chunksize=64
+            ))
+        finally:
+            ts_shm.close()
+            ts_shm.unlink()
+            active_shm.close()
+            active_shm.unlink()
     
-    def calculate_store_metrics(self, store_id: str) -> dict:
-        """metrics for a store """
-        # get max timestamp
-        max_timestamp = self.get_max_timestamp()
+    def _safe_metrics(self, store_id: str, ts_ns: np.ndarray, active: np.ndarray,
+                      max_timestamp: datetime) -> dict:
+        """store metrics, or a zeroed error row if the store can't be processed"""
+        try:
+            return self._metrics_from_arrays(store_id, ts_ns, active, max_timestamp)
+        except Exception as e:
+            logger.error(f"Error processing store {store_id}: {e}")
+            return self.error_metrics(store_id, e, max_timestamp)
+    
+    def error_metrics(self, store_id: str, error: Exception,
+                      max_timestamp: Optional[datetime] = None) -> dict:
+        """zeroed metrics row for a store that failed to process"""
+        if max_timestamp is None:
+            max_timestamp = self.get_max_timestamp()
         
-        # calculate time windows
-        last_hour_start = max_timestamp - timedelta(hours=1)
-        last_day_start = max_timestamp - timedelta(days=1)
-        last_week_start = max_timestamp - timedelta(days=7)
+        return {
+            "store_id": store_id,
+            "uptime_last_hour": 0,
+            "downtime_last_hour": 0,
+            "uptime_last_day": 0,
+            "downtime_last_day": 0,
+            "uptime_last_week": 0,
+            "downtime_last_week": 0,
+            "report_timestamp": max_timestamp.isoformat(),
+            "error": str(error)
+        }
+    
+    def _week_periods(self, max_timestamp: datetime, business_hours: Dict[int, Tuple[time, time]],
+                      timezone_str: str) -> np.ndarray:
+        """week business periods, computed once per timezone + schedule and reused across stores"""
+        key = (max_timestamp, timezone_str, tuple(sorted(business_hours.items())))
+        periods = self._overlap_cache.get(key)
+        if periods is None:
+            periods = self.calculate_business_hours_overlap(
+                max_timestamp - timedelta(days=7), max_timestamp, business_hours, timezone_str
+            )
+            # shared between stores, nothing may write to it
+            periods.flags.writeable = False
+            self._overlap_cache[key] = periods
+        return periods
+    
+    def _metrics_from_arrays(self, store_id: str, ts_ns: np.ndarray, active: np.ndarray,
+                             max_timestamp: datetime) -> dict:
+        """hour/day/week uptime within business hours from sorted week observations of one store"""
+        timezone_str = self.get_store_timezone(store_id)
+        business_hours = self.get_business_hours(store_id)
         
-        # get observations for each period
-        hour_obs = self.get_store_observations(store_id, last_hour_start, max_timestamp)
-        day_obs = self.get_store_observations(store_id, last_day_start, max_timestamp)
-        week_obs = self.get_store_observations(store_id, last_week_start, max_timestamp)
+        # localize business hours once for the week, all windows end at max_timestamp
+        week_periods = self._week_periods(max_timestamp, business_hours, timezone_str)
         
-        # count active vs inactive
-        def uptime_calculation(observations, total_minutes):
-            if not observations:
-                return total_minutes, 0  # assume active if no data
-            
-            active_count = sum(1 for _, status in observations if status == 'active')
-            total_count = len(observations)
-            
-            if total_count == 0:
-                return total_minutes, 0
-            
-            uptime_ratio = active_count / total_count
-            uptime = total_minutes * uptime_ratio
-            downtime = total_minutes - uptime
-            
-            return uptime, downtime
+        # hour and day are suffixes of the week, one walk over the week's periods
+        # and observations fills all three; window starts are plain int64 arithmetic
+        end_ns = _to_ns(max_timestamp)
+        window_starts = end_ns - np.array([NS_PER_HOUR, NS_PER_DAY, 7 * NS_PER_DAY])
+        uptime, downtime = self.interpolate_windows(ts_ns, active, week_periods, window_starts)
         
-        # calculate for each period
-        hour_up, hour_down = uptime_calculation(hour_obs, 60)
-        day_up, day_down = uptime_calculation(day_obs, 24 * 60)
-        week_up, week_down = uptime_calculation(week_obs, 7 * 24 * 60)
+        # plain floats, so round() below is Python's correctly rounded one
+        hour_up, day_up, week_up = uptime.tolist()
+        hour_down, day_down, week_down = downtime.tolist()
         
         return {
             "store_id": store_id,
@@ -269,4 +551,3 @@ class DataProcessor:
             "downtime_last_week": round(week_down / 60, 2),
             "report_timestamp": max_timestamp.isoformat()
         }
-       
\ No newline at end of file
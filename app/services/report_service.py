@@ -1,110 +1,316 @@
 import asyncio
 import uuid
 import csv
+import io
 import os
+import threading
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import AsyncIterator, Optional
 from app.services.data_processor import DataProcessor
-from app.models.database import SessionLocal
-from sqlalchemy import text
+from app.models.database import SessionLocal, ReportStatus, engine
+from sqlalchemy import insert, update, select, or_
+from sqlalchemy.orm import sessionmaker
+import pandas as pd
+import aiofiles
 import logging
 
 logger = logging.getLogger(__name__)
 
+REPORT_FIELDS = [
+    'store_id', 'uptime_last_hour', 'downtime_last_hour',
+    'uptime_last_day', 'downtime_last_day', 
+    'uptime_last_week', 'downtime_last_week'
+]
+
+# a report still Running after this long lost its worker to a restart, nothing will finish it
+STALE_REPORT_AGE = timedelta(hours=1)
+
+# with a Redis URL, reports are built by `rq worker reports` processes instead of
+# this server's own pool, so report capacity scales apart from the API
+REDIS_URL = os.getenv("REDIS_URL")
+REPORT_QUEUE = "reports"
+
+# metric processes per report on an rq worker; each worker host sizes this for itself
+RQ_METRIC_WORKERS = int(os.getenv("REPORT_METRIC_WORKERS", "1"))
+
+def _init_worker():
+    """Drop connections inherited from the parent, each worker opens its own"""
+    engine.dispose(close=False)
+
+def generate_report_file(report_id: str, max_timestamp: datetime, metric_workers: int = 1) -> dict:
+    """Compute all store metrics as of max_timestamp and write the report CSV, runs in a worker process"""
+    db = SessionLocal()
+    try:
+        processor = DataProcessor(db)
+        store_ids = processor.get_store_ids()
+        
+        logger.info(f"Processing {len(store_ids)} stores")
+        
+        logger.info(f"Using max timestamp: {max_timestamp}")
+        
+        filename = f"{report_id}.csv"
+        filepath = os.path.join("reports", filename)
+        
+        os.makedirs("reports", exist_ok=True)
+        
+        # append each batch as it's computed, memory stays at one chunk of rows
+        total_stores = 0
+        with open(filepath, 'w', newline='') as csvfile:
+            pd.DataFrame(columns=REPORT_FIELDS).to_csv(csvfile, index=False)
+            for batch in processor.iter_store_metrics_bulk(store_ids, max_timestamp, metric_workers):
+                # columns= drops report_timestamp/error, the C writer does the rest
+                pd.DataFrame(batch, columns=REPORT_FIELDS).to_csv(csvfile, header=False, index=False)
+                total_stores += len(batch)
+        
+        return {
+            "status": "Complete",
+            "file_path": filepath,
+            "total_stores": total_stores
+        }
+    finally:
+        db.close()
+
+def update_report_status(session_factory, report_id: str, status: str, file_path: str = None):
+    """Record a report's final status, single UPDATE with no load-then-flush round trip"""
+    with session_factory() as db:
+        db.execute(
+            update(ReportStatus)
+            .where(ReportStatus.report_id == report_id)
+            .values(
+                status=status,
+                completed_at=datetime.now(timezone.utc),
+                file_path=file_path
+            )
+        )
+        db.commit()
+
+def run_report_job(report_id: str, max_timestamp: datetime) -> dict:
+    """RQ job: build the report and record how it went"""
+    try:
+        result = generate_report_file(report_id, max_timestamp, RQ_METRIC_WORKERS)
+    except Exception:
+        update_report_status(SessionLocal, report_id, "Failed")
+        raise
+    
+    update_report_status(SessionLocal, report_id, result["status"], result["file_path"])
+    return result
+
 class ReportService:
-    def __init__(self, db=None):
-        self.db = db
-        self.reports = {}
+    def __init__(self, engine=None, max_concurrent_reports: int = 2, metric_workers: int = 1):
+        self.session_factory = (
+            sessionmaker(autocommit=False, autoflush=False, bind=engine) if engine else SessionLocal
+        )
         self.max_workers = 10  
+        
+        # report generation is CPU-bound, keep it off the event loop and bound its concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrent_reports)
+        # processes each report may fan its store metrics out to, on top of the report pool
+        self._metric_workers = metric_workers
+        self._queue = None
+        self._executor = None
+        if REDIS_URL:
+            from redis import Redis
+            from rq import Queue
+            self._queue = Queue(REPORT_QUEUE, connection=Redis.from_url(REDIS_URL))
+        else:
+            self._executor = ProcessPoolExecutor(
+                max_workers=max_concurrent_reports, initializer=_init_worker
+            )
+        self._tasks = set()
     
-    def trigger_report(self) -> str:
-        """Trigger a new report generation"""
+    def close(self):
+        """Stop the report worker processes"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+    
+    async def fail_stale_reports(self) -> int:
+        """Mark reports orphaned by a restart as Failed"""
+        count = await asyncio.to_thread(self._fail_stale_reports)
+        if count:
+            logger.warning(f"Marked {count} stale running reports as Failed")
+        return count
+    
+    async def trigger_report(self) -> str:
+        """Trigger a new report generation, reusing the report for unchanged data"""
+        max_timestamp = await asyncio.to_thread(self._get_max_timestamp)
+        
+        # report_status is shared by every worker, so any of them reuses the snapshot's report
+        existing_report_id = await asyncio.to_thread(self._find_report, max_timestamp)
+        if existing_report_id is not None:
+            logger.info(f"Reusing report {existing_report_id} for data up to {max_timestamp}")
+            return existing_report_id
+        
         report_id = str(uuid.uuid4())
-        self.reports[report_id] = {"status": "Running"}
+        await asyncio.to_thread(self._insert_status, report_id, max_timestamp)
         
-        asyncio.create_task(self._generate_report(report_id))
+        # build the report for the same snapshot it's recorded under
+        task = asyncio.create_task(self._generate_report(report_id, max_timestamp))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
         return report_id
     
-    def get_report_status(self, report_id: str) -> dict:
+    async def get_report_status(self, report_id: str) -> dict:
         """Get report status"""
-        if report_id not in self.reports:
+        return await asyncio.to_thread(self._read_status, report_id)
+    
+    def _get_max_timestamp(self):
+        with self.session_factory() as db:
+            return DataProcessor(db).get_max_timestamp()
+    
+    def _find_report(self, max_timestamp: datetime) -> Optional[str]:
+        """latest report for this snapshot that is complete or still being built"""
+        now = datetime.now(timezone.utc)
+        with self.session_factory() as db:
+            return db.execute(
+                select(ReportStatus.report_id)
+                .where(
+                    ReportStatus.max_timestamp == max_timestamp,
+                    ReportStatus.status != "Failed",
+                    # a Running report past STALE_REPORT_AGE lost its worker, see _read_status
+                    or_(ReportStatus.status != "Running",
+                        ReportStatus.created_at >= now - STALE_REPORT_AGE)
+                )
+                .order_by(ReportStatus.created_at.desc())
+                .limit(1)
+            ).scalar()
+    
+    # status lives in report_status so every uvicorn worker sees the same reports
+    def _insert_status(self, report_id: str, max_timestamp: datetime):
+        with self.session_factory() as db:
+            db.execute(insert(ReportStatus).values(
+                report_id=report_id,
+                status="Running",
+                created_at=datetime.now(timezone.utc),
+                max_timestamp=max_timestamp
+            ))
+            db.commit()
+    
+    def _update_status(self, report_id: str, status: str, file_path: str = None):
+        update_report_status(self.session_factory, report_id, status, file_path)
+    
+    def _fail_stale_reports(self, report_id: str = None) -> int:
+        now = datetime.now(timezone.utc)
+        stmt = update(ReportStatus).where(
+            ReportStatus.status == "Running",
+            ReportStatus.created_at < now - STALE_REPORT_AGE
+        )
+        if report_id is not None:
+            stmt = stmt.where(ReportStatus.report_id == report_id)
+        with self.session_factory() as db:
+            result = db.execute(stmt.values(status="Failed", completed_at=now))
+            db.commit()
+            return result.rowcount
+    
+    def _get_report(self, report_id: str):
+        with self.session_factory() as db:
+            return db.get(ReportStatus, report_id)
+    
+    def _read_status(self, report_id: str) -> dict:
+        report = self._get_report(report_id)
+        
+        if report is None:
             return {"status": "Not Found"}
-        return self.reports[report_id]
+        
+        # the startup sweep misses reports younger than STALE_REPORT_AGE when their
+        # worker died, so age out a Running report whenever it's read
+        if (report.status == "Running"
+                and report.created_at < datetime.now(timezone.utc) - STALE_REPORT_AGE
+                and self._fail_stale_reports(report_id)):
+            return {"status": "Failed"}
+        
+        status = {"status": report.status}
+        if report.file_path:
+            status["filename"] = os.path.basename(report.file_path)
+        return status
+    
+    async def iter_rows(self, report_id: str) -> AsyncIterator[str]:
+        """Stream report CSV, the finished file if there is one, else one store row per
+        chunk as metrics are computed for the report's own snapshot"""
+        logger.info(f"Streaming report {report_id}")
+        
+        report = await asyncio.to_thread(self._get_report, report_id)
+        if report is not None and report.status == "Complete" and report.file_path:
+            # same bytes /get_report serves
+            async with aiofiles.open(report.file_path, newline='') as report_file:
+                while chunk := await report_file.read(64 * 1024):
+                    yield chunk
+            return
+        
+        db = self.session_factory()
+        sessions = [db]
+        local = threading.local()
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            processor = DataProcessor(db)
+            store_ids = await asyncio.to_thread(processor.get_store_ids)
+            await asyncio.to_thread(processor.preload)
+            
+            # every row is computed against the snapshot the report was triggered for
+            # (current data only for rows written before snapshots were recorded)
+            max_timestamp = report.max_timestamp if report is not None else None
+            if max_timestamp is None:
+                max_timestamp = await asyncio.to_thread(processor.get_max_timestamp)
+            
+            def compute(store_id: str) -> dict:
+                # sessions aren't thread-safe, each pool thread gets its own
+                if not hasattr(local, "processor"):
+                    session = self.session_factory()
+                    sessions.append(session)
+                    local.processor = processor.for_session(session)
+                try:
+                    return local.processor.calculate_store_metrics(store_id, max_timestamp)
+                except Exception as e:
+                    logger.error(f"Error processing store {store_id}: {e}")
+                    return local.processor.error_metrics(store_id, e, max_timestamp)
+            
+            # one buffer reused for every row
+            buf = io.StringIO()
+            writer = csv.DictWriter(buf, fieldnames=REPORT_FIELDS, extrasaction='ignore')
+            
+            writer.writeheader()
+            yield buf.getvalue()
+            
+            # stores wait on their own observation query, overlap them and emit as each finishes
+            loop = asyncio.get_running_loop()
+            futures = [loop.run_in_executor(executor, compute, store_id) for store_id in store_ids]
+            for future in asyncio.as_completed(futures):
+                metrics = await future
+                buf.seek(0)
+                buf.truncate(0)
+                writer.writerow(metrics)
+                yield buf.getvalue()
+        finally:
+            await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
+            for session in sessions:
+                session.close()
     
-    async def _generate_report(self, report_id: str):
+    async def _generate_report(self, report_id: str, max_timestamp: datetime):
         """Generate the actual report"""
         try:
             logger.info(f"Starting report generation for {report_id}")
             
-            db = SessionLocal()
-            try:
-                result = db.execute(text("SELECT DISTINCT store_id FROM store_status"))
-                store_ids = [row[0] for row in result.fetchall()]
-                
-                logger.info(f"Processing {len(store_ids)} stores")
-                
-                all_metrics = []
-                processor = DataProcessor(db)
-                
-                max_timestamp = processor.get_max_timestamp()
-                logger.info(f"Using max timestamp: {max_timestamp}")
-                
-                batch_size = 10
-                for i in range(0, len(store_ids), batch_size):
-                    batch = store_ids[i:i + batch_size]
-                    batch_metrics = []
-                    
-                    for store_id in batch:
-                        try:
-                            metrics = processor.calculate_store_metrics(store_id)
-                            batch_metrics.append(metrics)
-                        except Exception as e:
-                            logger.error(f"Error processing store {store_id}: {e}")
-                            batch_metrics.append({
-                                "store_id": store_id,
-                                "uptime_last_hour": 0,
-                                "downtime_last_hour": 0,
-                                "uptime_last_day": 0,
-                                "downtime_last_day": 0,
-                                "uptime_last_week": 0,
-                                "downtime_last_week": 0,
-                                "report_timestamp": max_timestamp.isoformat(),
-                                "error": str(e)
-                            })
-                    
-                    all_metrics.extend(batch_metrics)
-                    logger.info(f"Processed batch {i//batch_size + 1}/{(len(store_ids)-1)//batch_size + 1}")
-                
-                filename = f"{report_id}.csv"
-                filepath = os.path.join("reports", filename)
-                
-                os.makedirs("reports", exist_ok=True)
-                
-                with open(filepath, 'w', newline='') as csvfile:
-                    fieldnames = [
-                        'store_id', 'uptime_last_hour', 'downtime_last_hour',
-                        'uptime_last_day', 'downtime_last_day', 
-                        'uptime_last_week', 'downtime_last_week'
-                    ]
-                    writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-                    writer.writeheader()
-                    
-                    for metrics in all_metrics:
-                        csv_row = {k: v for k, v in metrics.items() if k in fieldnames}
-                        writer.writerow(csv_row)
-                
-                self.reports[report_id] = {
-                    "status": "Complete",
-                    "filename": filename,
-                    "total_stores": len(all_metrics)
-                }
-                
-                logger.info(f"Report {report_id} completed successfully")
-                
-            finally:
-                db.close()
+            # the rq worker records the outcome itself
+            if self._queue is not None:
+                await asyncio.to_thread(
+                    self._queue.enqueue, run_report_job, report_id, max_timestamp,
+                    job_timeout=int(STALE_REPORT_AGE.total_seconds())
+                )
+                logger.info(f"Report {report_id} queued on {REPORT_QUEUE}")
+                return
+            
+            async with self._semaphore:
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(
+                    self._executor, generate_report_file, report_id, max_timestamp,
+                    self._metric_workers
+                )
+            
+            await asyncio.to_thread(
+                self._update_status, report_id, result["status"], result["file_path"]
+            )
+            logger.info(f"Report {report_id} completed successfully")
             
         except Exception as e:
             logger.error(f"Report generation failed for {report_id}: {e}")
-            self.reports[report_id] = {
-                "status": "Failed", 
-                "error": str(e)
-            }
\ No newline at end of file
+            await asyncio.to_thread(self._update_status, report_id, "Failed")
\ No newline at end of file
@@ -0,0 +1,5 @@
+import os
+
+# app.models.database builds its engine at import; create_engine doesn't connect,
+# so the pure computation tests run without a database
+os.environ.setdefault("DATABASE_URL", "postgresql://localhost/test")
@@ -0,0 +1,181 @@
+"""business-hours uptime from the compiled kernel against a plain-Python reference"""
+import bisect
+import random
+from datetime import datetime, timedelta, time, timezone
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pytest
+
+from app.services.data_processor import DataProcessor, NS_PER_DAY, NS_PER_HOUR, _to_ns
+
+WINDOWS = (timedelta(hours=1), timedelta(days=1), timedelta(days=7))
+
+def to_utc(local: datetime, tz: ZoneInfo) -> datetime:
+    """naive local time -> UTC; repeated times take standard time, skipped ones the end of the gap"""
+    while True:
+        # fold=1 is the second (standard time) occurrence of a repeated wall time
+        utc = local.replace(tzinfo=tz, fold=1).astimezone(timezone.utc)
+        if utc.astimezone(tz).replace(tzinfo=None) == local:
+            return utc
+        local += timedelta(minutes=1)
+
+def reference_periods(start: datetime, end: datetime, business_hours: dict, timezone_str: str) -> list:
+    """business hours within [start, end) as merged UTC intervals, one local day at a time"""
+    tz = ZoneInfo(timezone_str)
+    day = start.astimezone(tz).date() - timedelta(days=1)
+    intervals = []
+    while day <= end.astimezone(tz).date():
+        if day.weekday() in business_hours:
+            open_at, close_at = business_hours[day.weekday()]
+            close_day = day + timedelta(days=1) if close_at < open_at else day
+            lo = max(to_utc(datetime.combine(day, open_at), tz), start)
+            hi = min(to_utc(datetime.combine(close_day, close_at), tz), end)
+            if lo < hi:
+                intervals.append([lo, hi])
+        day += timedelta(days=1)
+
+    merged = []
+    for lo, hi in sorted(intervals):
+        if merged and lo <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], hi)
+        else:
+            merged.append([lo, hi])
+    return merged
+
+def reference_minutes(observations: list, periods: list, window_start: datetime) -> tuple:
+    """uptime/downtime minutes of the periods after window_start; a status holds until the
+    next observation, before the first one a period takes the first status inside it, else active"""
+    times = [ts for ts, _ in observations]
+    up = down = timedelta(0)
+    for lo, hi in periods:
+        inside = [i for i, ts in enumerate(times) if lo <= ts <= hi]
+        cuts = [lo] + [times[i] for i in inside] + [hi]
+        for seg_lo, seg_hi in zip(cuts, cuts[1:]):
+            seg_lo_w = max(seg_lo, window_start)
+            if seg_hi <= seg_lo_w:
+                continue
+            i = bisect.bisect_right(times, seg_lo) - 1
+            if i >= 0:
+                is_active = observations[i][1]
+            elif inside:
+                is_active = observations[inside[0]][1]
+            else:
+                is_active = True
+            if is_active:
+                up += seg_hi - seg_lo_w
+            else:
+                down += seg_hi - seg_lo_w
+    return up / timedelta(minutes=1), down / timedelta(minutes=1)
+
+def processor(timezone_str: str, business_hours: dict) -> DataProcessor:
+    """processor for one store "s" with preloaded config, no database"""
+    dp = DataProcessor(None)
+    dp._tz_map = {"s": timezone_str}
+    dp._bh_map = {"s": business_hours}
+    return dp
+
+def observation_arrays(observations: list) -> tuple:
+    ts_ns = np.array([_to_ns(ts) for ts, _ in observations], dtype=np.int64)
+    active = np.array([is_active for _, is_active in observations], dtype=np.int8)
+    return ts_ns, active
+
+def assert_matches_reference(timezone_str: str, business_hours: dict, max_timestamp: datetime,
+                             observations: list):
+    dp = processor(timezone_str, business_hours)
+    week_start = max_timestamp - timedelta(days=7)
+    periods = dp.calculate_business_hours_overlap(week_start, max_timestamp, business_hours, timezone_str)
+    window_starts = _to_ns(max_timestamp) - np.array([NS_PER_HOUR, NS_PER_DAY, 7 * NS_PER_DAY])
+    uptime, downtime = dp.interpolate_windows(*observation_arrays(observations), periods, window_starts)
+
+    expected_periods = reference_periods(week_start, max_timestamp, business_hours, timezone_str)
+    assert periods.tolist() == [[_to_ns(lo), _to_ns(hi)] for lo, hi in expected_periods]
+    for w, window in enumerate(WINDOWS):
+        expected = reference_minutes(observations, expected_periods, max_timestamp - window)
+        assert (uptime[w], downtime[w]) == pytest.approx(expected)
+
+def random_observations(seed: int, start: datetime, end: datetime, count: int) -> list:
+    rng = random.Random(seed)
+    span = int((end - start).total_seconds())
+    return sorted(
+        (start + timedelta(seconds=rng.randrange(span)), rng.random() < 0.7) for _ in range(count)
+    )
+
+OVERNIGHT = {1: (time(18, 0), time(2, 0)), 2: (time(0, 0), time(12, 0))}
+# Sunday 2024-03-10, America/Chicago skips 02:00-03:00
+DST_GAP_MAX = datetime(2024, 3, 11, 12, 0, tzinfo=timezone.utc)
+# Sunday 2024-11-03, America/Chicago repeats 01:00-02:00
+DST_FOLD_MAX = datetime(2024, 11, 4, 12, 0, tzinfo=timezone.utc)
+
+def test_overnight_hours_overlapping_next_day_are_counted_once():
+    # Tuesday 18:00-02:00 runs into Wednesday 00:00-12:00
+    max_timestamp = datetime(2024, 10, 16, 3, 0, tzinfo=timezone.utc)
+    metrics = processor("UTC", OVERNIGHT)._metrics_from_arrays(
+        "s", np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int8), max_timestamp
+    )
+    assert metrics["uptime_last_hour"] == 60.0
+    assert metrics["uptime_last_day"] == 9.0
+    assert metrics["uptime_last_week"] == 18.0
+    assert metrics["downtime_last_week"] == 0.0
+
+@pytest.mark.parametrize("timezone_str", ["UTC", "America/Chicago", "Asia/Kolkata"])
+def test_overnight_hours(timezone_str):
+    max_timestamp = datetime(2024, 10, 16, 3, 0, tzinfo=timezone.utc)
+    observations = random_observations(1, max_timestamp - timedelta(days=7), max_timestamp, 40)
+    assert_matches_reference(timezone_str, OVERNIGHT, max_timestamp, observations)
+
+@pytest.mark.parametrize("business_hours", [
+    {6: (time(1, 0), time(4, 0))},
+    {6: (time(2, 30), time(5, 0))},
+    {5: (time(22, 0), time(2, 30)), 6: (time(2, 15), time(9, 0))},
+])
+def test_dst_gap_day(business_hours):
+    observations = random_observations(2, DST_GAP_MAX - timedelta(days=7), DST_GAP_MAX, 30)
+    assert_matches_reference("America/Chicago", business_hours, DST_GAP_MAX, observations)
+
+@pytest.mark.parametrize("business_hours", [
+    {6: (time(0, 30), time(3, 0))},
+    {6: (time(1, 30), time(4, 0))},
+    {5: (time(20, 0), time(1, 30)), 6: (time(1, 15), time(6, 0))},
+])
+def test_dst_fold_day(business_hours):
+    observations = random_observations(3, DST_FOLD_MAX - timedelta(days=7), DST_FOLD_MAX, 30)
+    assert_matches_reference("America/Chicago", business_hours, DST_FOLD_MAX, observations)
+
+def test_no_observations_counts_business_hours_as_up():
+    assert_matches_reference("America/Chicago", {6: (time(1, 0), time(4, 0))}, DST_GAP_MAX, [])
+
+def test_no_prior_observation_takes_first_status_inside_period():
+    max_timestamp = datetime(2024, 10, 16, 3, 0, tzinfo=timezone.utc)
+    observations = [
+        (datetime(2024, 10, 15, 20, 0, tzinfo=timezone.utc), False),
+        (datetime(2024, 10, 15, 23, 0, tzinfo=timezone.utc), True),
+    ]
+    assert_matches_reference("UTC", OVERNIGHT, max_timestamp, observations)
+
+    # Tuesday 18:00-20:00 has nothing before it and takes the first (inactive) status
+    _, downtime = processor("UTC", OVERNIGHT).interpolate_windows(
+        *observation_arrays(observations),
+        np.array([[_to_ns(max_timestamp - timedelta(hours=9)), _to_ns(max_timestamp)]]),
+        np.array([_to_ns(max_timestamp - timedelta(days=1))])
+    )
+    assert downtime.tolist() == [300.0]
+
+def test_status_before_window_carries_into_it():
+    max_timestamp = datetime(2024, 10, 16, 3, 0, tzinfo=timezone.utc)
+    observations = [(datetime(2024, 10, 9, 4, 0, tzinfo=timezone.utc), False)]
+    assert_matches_reference("UTC", OVERNIGHT, max_timestamp, observations)
+
+    metrics = processor("UTC", OVERNIGHT)._metrics_from_arrays(
+        "s", *observation_arrays(observations), max_timestamp
+    )
+    assert metrics["downtime_last_week"] == 18.0
+    assert metrics["downtime_last_day"] == 9.0
+    assert metrics["downtime_last_hour"] == 60.0
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_week_matches_reference(seed):
+    max_timestamp = datetime(2024, 10, 16, 3, 0, tzinfo=timezone.utc)
+    business_hours = {1: (time(9, 0), time(17, 0)), 4: (time(22, 0), time(6, 0)), 5: (time(0, 0), time(23, 59, 59))}
+    observations = random_observations(seed, max_timestamp - timedelta(days=8), max_timestamp, 60)
+    assert_matches_reference("America/New_York", business_hours, max_timestamp, observations)